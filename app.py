@@ -1,16 +1,23 @@
+from __future__ import annotations
+
 import argparse
+import atexit
 import os
+import struct
 import sys
+import threading
 import time
-from datetime import datetime
-from typing import Dict, List, Tuple
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+
+from flask import Flask, Response, jsonify, render_template, request
 
-from flask import Flask, jsonify, render_template
 try:
+    import orjson  # optional, schnellere JSON-Serialisierung für /api/current
+except ImportError:
+    orjson = None
+
+if TYPE_CHECKING:
     import serial  # pyserial
-except Exception as e:
-    print("pySerial fehlt. Installiere mit:  pip install pyserial", file=sys.stderr)
-    raise
 
 # ---- Protokoll-Konstanten (D-LOGG / UVR) ----
 CMD_MODE        = 0x81  # Modusabfrage
@@ -20,6 +27,11 @@ TYPE_UVR61_3    = 0x90  # (unterstützen wir hier nicht im Detail)
 MODE_1DL        = 0xA8
 MODE_2DL        = 0xD1
 
+# Sensoren T1..T16: 16 * (low, high) = 16 Little-Endian-Worte am Blockanfang
+_UVR_STRUCT = struct.Struct("<16H")
+# Ausgänge A1..A13 (Bit i im Ausgangswort = A(i+1))
+_A_KEYS = tuple(f"A{i+1}" for i in range(13))
+
 # ---- Sensor-Namen (Mapping) ----
 # (Nicht belegte IDs bleiben unbenannt/werden nicht angezeigt)
 SENSOR_LABELS = {
@@ -34,10 +46,26 @@ SENSOR_LABELS = {
     14: "Kessel Vorlauf",               # T14
     16: "Puffer unten 2",               # T16 (zweiter Fühler unten)
 }
+# (Index 0..15, Label) nur für benannte Sensoren, nach Index sortiert – der Merge je Request
+# läuft nur über diese Paare statt über alle 16 Kanäle
+_LABEL_PAIRS = tuple(sorted((t - 1, label) for t, label in SENSOR_LABELS.items()))
 
 # ---- Serial helper ----
+# pySerial-Modul, wird beim ersten Bedarf einmalig geladen (das Parsen der Frames kommt ohne aus)
+_SERIAL_MOD = None
+
+def _import_serial():
+    global _SERIAL_MOD
+    if _SERIAL_MOD is None:
+        try:
+            import serial  # pyserial
+        except ImportError as e:
+            raise RuntimeError("pySerial fehlt. Installiere mit:  pip install pyserial") from e
+        _SERIAL_MOD = serial
+    return _SERIAL_MOD
+
 def open_serial(port: str, baud: int = 115200, timeout: float = 2.0) -> serial.Serial:
-    return serial.Serial(port=port, baudrate=baud, timeout=timeout)
+    return _import_serial().Serial(port=port, baudrate=baud, timeout=timeout)
 
 def query_mode(ser: serial.Serial) -> int:
     ser.reset_input_buffer()
@@ -47,26 +75,26 @@ def query_mode(ser: serial.Serial) -> int:
         raise RuntimeError("Keine Antwort auf Modusabfrage.")
     return b[0]
 
-def request_current(ser: serial.Serial) -> bytes:
+def request_current(ser: serial.Serial, mode: int) -> bytes:
     """
     Holt einen 'Aktuelle Daten' Frame.
     Hält 1DL (57 Bytes) und 2DL (113 Bytes) für UVR1611 aus.
+    mode (Antwort von query_mode) legt die erwartete Länge fest: nur bei MODE_2DL
+    wird der zweite Block gelesen.
+    Kommt der zweite Block unvollständig an, wird nur der erste (57 Bytes) zurückgegeben.
     """
     ser.reset_input_buffer()
     ser.write(bytes([CMD_CURRENT]))
-    time.sleep(0.05)  # mini delay
 
-    buf = ser.read(200)  # genug groß für 2DL
-    # Aufräumen: nur sinnvolle Längen
-    if len(buf) in (57, 113):
+    # read(n) blockiert nur bis n Bytes da sind (max. timeout) – kein fester Delay nötig
+    buf = ser.read(57)
+    if len(buf) == 57 and mode == MODE_2DL:
+        # 2DL: zweiter Geräteblock + Checksum folgen direkt
+        buf += ser.read(56)
+    if len(buf) == 113:
         return buf
-
-    # gelegentlich liefert der D-LOGG in zwei Stücken; ein wenig nachfassen
-    extra = ser.read(200)
-    buf += extra
-    if len(buf) >= 113:
-        return buf[:113]
     if len(buf) >= 57:
+        # 2DL, aber zweiter Block zu kurz/Timeout: Gerät 1 trotzdem auswerten
         return buf[:57]
 
     raise RuntimeError(f"Kein valider Antwort-Frame empfangen (len={len(buf)}).")
@@ -78,13 +106,14 @@ def _decode_sensor_value(low: int, high: int) -> Tuple[str, float]:
     Decodiert einen 2-Byte Eingang Tn (UVR1611).
     Gibt (kind, value) zurück, wobei kind z.B. 'temp', 'flow', 'radiation', 'digital', 'unused' ist.
     Für das Dashboard nutzen wir nur 'temp'.
+    Referenz-Decoder für alle Eingangstypen: der Abruf selbst nutzt _decode_temps
+    (Tabelle _TEMP_OFFSETS), diese Funktion wird dort nicht aufgerufen.
     """
     # Einheit/Typ steckt in den Bits 4..6 des high-Bytes
     etype = (high >> 4) & 0b111
 
     # Temp-/Flow-/Radiation-Werte basieren auf 12 Bit Nutzwert (low + high[0..3])
     raw12 = ((high & 0x0F) << 8) | low
-    sign = (high & 0x80) != 0
 
     if etype == 0b000:
         return ("unused", float("nan"))
@@ -94,8 +123,9 @@ def _decode_sensor_value(low: int, high: int) -> Tuple[str, float]:
         bit = 1.0 if raw12 else 0.0
         return ("digital", bit)
     if etype == 0b010:
-        # Temperatur (1/10 °C), kann negativ sein (12-bit two's complement)
-        val = -(((~raw12) & 0x0FFF) + 1) if sign else raw12
+        # Temperatur (1/10 °C), kann negativ sein (12-bit two's complement):
+        # Vorzeichen-Bit 7 des high-Bytes zieht 0x1000 ab (0x80 << 5), ohne Verzweigung
+        val = raw12 - ((high & 0x80) << 5)
         return ("temp", val / 10.0)
     if etype == 0b011:
         # Volumenstrom (4 l/h) – hier nicht genutzt
@@ -114,70 +144,107 @@ def _decode_sensor_value(low: int, high: int) -> Tuple[str, float]:
     # Fallback
     return ("unknown", float("nan"))
 
-def _parse_uvr1611_block(dev_type: int, data55: bytes) -> Dict:
+def _build_temp_offsets() -> Tuple[Optional[int], ...]:
+    """
+    Tabelle high-Byte -> Offset in 1/10 °C (None = kein Temperatur-Eingang).
+    Für beide Temperatur-Typen gilt damit: Wert = (Offset + low) / 10.
+    Wird einmal beim Laden des Moduls berechnet.
+    """
+    offsets: List[Optional[int]] = []
+    for high in range(256):
+        etype = (high >> 4) & 0b111
+        if etype == 0b010:
+            # 12 Bit Nutzwert, Vorzeichen in Bit 7 des high-Bytes
+            offsets.append(((high & 0x0F) << 8) - ((high & 0x80) << 5))
+        elif etype == 0b111:
+            # Raumtemperatur: +256 wenn unterstes Bit im High gesetzt
+            offsets.append((high & 0x01) << 8)
+        else:
+            offsets.append(None)
+    return tuple(offsets)
+
+_TEMP_OFFSETS = _build_temp_offsets()
+
+def _decode_temps(data55: Union[bytes, memoryview]) -> Tuple[List[float], int]:
+    """
+    Decodiert nur die Temperatur-Eingänge T1..T16 eines UVR1611-Blocks in einem Durchlauf.
+    Gleiches Ergebnis wie _decode_sensor_value (etype 0b010 und 0b111), aber pro Sensor nur
+    ein Tabellenzugriff über das high-Byte statt Bit-Arithmetik und Verzweigungen.
+    Rückgabe: (temps, mask) – temps[i] in °C für Sensor-Index 0..15 (NaN = keine Temperatur),
+    Bit i in mask gesetzt, wenn temps[i] gültig ist.
+    """
+    temps = [float("nan")] * 16
+    mask = 0
+    for i, word in enumerate(_UVR_STRUCT.unpack_from(data55, 0)):
+        offset = _TEMP_OFFSETS[word >> 8]
+        if offset is not None:
+            temps[i] = (offset + (word & 0xFF)) / 10.0
+            mask |= 1 << i
+    return temps, mask
+
+def _parse_uvr1611_block(dev_type: int, data55: Union[bytes, memoryview],
+                         include_outputs: bool = False) -> Dict:
     """
     Parsen eines UVR1611-Blocks innerhalb 'Aktuelle Daten'.
     data55: genau 55 Bytes (alles nach dem Typbyte, ohne Checksum), Reihenfolge wie im D-LOGG.
-    Rückgabe: {"type": "UVR1611", "temps": {"T1":..}, "outputs": {...}}
+    Rückgabe: {"type": "UVR1611", "temps": [16 Werte], "temp_mask": int}
+    'temps' ist nach Sensor-Index 0..15 (= T1..T16) geordnet; gültig ist temps[i] nur,
+    wenn Bit i in 'temp_mask' gesetzt ist.
+    Mit include_outputs=True kommt zusätzlich "outputs": {"A1": 0/1, ...} hinzu
+    (das Dashboard braucht nur die Temperaturen).
     """
     if dev_type != TYPE_UVR1611 or len(data55) != 55:
         raise ValueError("Block ist nicht UVR1611 oder falsche Länge.")
 
     # Sensoren T1..T16: 32 Byte => 16 * (low, high)
-    temps: Dict[str, float] = {}
-    for i in range(16):
-        low = data55[2*i + 0]
-        high = data55[2*i + 1]
-        kind, val = _decode_sensor_value(low, high)
-        if kind == "temp":
-            temps[f"T{i+1}"] = val
-
-    # Ausgänge (optional, falls später benötigt)
-    ausgbyte1 = data55[32]   # A1..A8
-    ausgbyte2 = data55[33]   # A9..A13 in unteren Bits
-    outputs = {}
-    for bit in range(8):
-        outputs[f"A{bit+1}"] = 1 if (ausgbyte1 >> bit) & 1 else 0
-    for bit in range(5):
-        outputs[f"A{bit+9}"] = 1 if (data55[33] >> bit) & 1 else 0
+    temps, temp_mask = _decode_temps(data55)
 
-    return {
+    dev = {
         "type": "UVR1611",
         "temps": temps,
-        "outputs": outputs,
+        "temp_mask": temp_mask,
     }
 
-def parse_current_frame(buf: bytes) -> List[Dict]:
+    if include_outputs:
+        # data55[32] = A1..A8, data55[33] = A9..A13 in unteren Bits
+        bits = data55[32] | (data55[33] << 8)
+        dev["outputs"] = {key: (bits >> i) & 1 for i, key in enumerate(_A_KEYS)}
+
+    return dev
+
+def parse_current_frame(buf: Union[bytes, memoryview], include_outputs: bool = False) -> List[Dict]:
     """
     Nimmt einen 'Aktuelle Daten' Puffer (1DL=57B, 2DL=113B) und liefert eine Liste von Geräten.
-    Jedes Gerät als Dict mit 'type', 'temps', 'outputs'.
+    Jedes Gerät als Dict mit 'type', 'temps', 'temp_mask' (+ 'outputs' bei include_outputs).
     """
     devices: List[Dict] = []
+    # Geräteblöcke als Views auf buf ausschneiden (keine Kopie je Block)
+    mv = memoryview(buf)
 
     if len(buf) == 57 and buf[0] == TYPE_UVR1611:
         # 1DL, 1 Gerät (UVR1611): [type][55 data][checksum]
-        data55 = buf[1:56]
-        devices.append(_parse_uvr1611_block(TYPE_UVR1611, data55))
+        data55 = mv[1:56]
+        devices.append(_parse_uvr1611_block(TYPE_UVR1611, data55, include_outputs))
         return devices
 
     if len(buf) == 113 and buf[0] in (TYPE_UVR1611, TYPE_UVR61_3):
         # 2DL: layout (UVR1611/61-3 gemischt möglich):
         # [type1][55 bytes dev1][type2][55 bytes dev2][checksum]
         t1 = buf[0]
-        d1 = buf[1:56]
+        d1 = mv[1:56]
         t2 = buf[56]
-        d2 = buf[57:112]
+        d2 = mv[57:112]
         # checksum = buf[112]  # (hier nicht geprüft)
 
         if t1 == TYPE_UVR1611:
             try:
-                devices.append(_parse_uvr1611_block(t1, d1))
+                devices.append(_parse_uvr1611_block(t1, d1, include_outputs))
             except Exception:
                 pass
         # UVR61_3 lassen wir (fürs Temperaturlayout) weg oder später ergänzen.
         if t2 == TYPE_UVR1611:
             try:
-                devices.append(_parse_uvr1611_block(t2, d2))
+                devices.append(_parse_uvr1611_block(t2, d2, include_outputs))
             except Exception:
                 pass
 
@@ -192,43 +259,156 @@ app = Flask(__name__)
 # Konfiguration über Env/Args
 SERIAL_PORT = os.environ.get("DLOGG_PORT", "COM4")  # auf dem Pi z.B. /dev/ttyUSB0
 
+# Der Port bleibt zwischen Requests offen (Öffnen kostet TTY-Setup/DTR-Toggle).
+# Jeder Zugriff auf _SER läuft unter _SER_LOCK.
+_SER: Optional[serial.Serial] = None
+_SER_LOCK = threading.Lock()
+
+def _get_ser() -> serial.Serial:
+    """
+    Liefert den gemeinsamen Port und öffnet ihn bei Bedarf.
+    Aufrufer muss _SER_LOCK halten.
+    """
+    global _SER
+    if _SER is None or not _SER.is_open:
+        _SER = open_serial(SERIAL_PORT)
+    return _SER
+
+def _close_ser() -> None:
+    """
+    Schließt den gemeinsamen Port; der nächste _get_ser() öffnet neu.
+    Aufrufer muss _SER_LOCK halten.
+    """
+    global _SER
+    if _SER is not None:
+        try:
+            _SER.close()
+        except Exception:
+            pass
+        _SER = None
+
+def _close_ser_at_exit() -> None:
+    """
+    Beim Beenden: Port unter _SER_LOCK schließen (der Abfrage-Thread kann gerade lesen).
+    Hängt ein Abruf länger als das Port-Timeout, wird nicht auf ihn gewartet.
+    """
+    if _SER_LOCK.acquire(timeout=3.0):
+        try:
+            _close_ser()
+        finally:
+            _SER_LOCK.release()
+
+atexit.register(_close_ser_at_exit)
+
+def _read_frame(ser: serial.Serial) -> bytes:
+    mode = query_mode(ser)  # 0xA8 (1DL) oder 0xD1 (2DL) -> erwartete Frame-Länge
+    return request_current(ser, mode)
+
 def read_all_devices() -> Dict:
     """
-    Öffnet seriell kurz, fragt Modus & aktuelle Daten ab, parst.
-    Liefert ein JSON-geeignetes Dict mit gemappten Namen.
+    Fragt über den offenen Port Modus & aktuelle Daten ab, parst.
+    Liefert ein JSON-geeignetes Dict mit gemappten Namen (direkt als /api/current-Antwort).
     """
-    with open_serial(SERIAL_PORT) as ser:
-        mode = query_mode(ser)  # 0xA8 (1DL) oder 0xD1 (2DL)
-        _ = mode  # aktuell nicht benötigt
-        buf = request_current(ser)
-        devices = parse_current_frame(buf)
+    serial_error = _import_serial().SerialException
+    with _SER_LOCK:
+        for attempt in range(2):
+            try:
+                buf = _read_frame(_get_ser())
+                break
+            except serial_error:
+                # z.B. D-LOGG ab-/angesteckt: Port einmal neu öffnen und wiederholen
+                _close_ser()
+                if attempt:
+                    raise
+    devices = parse_current_frame(buf)
 
     # Mappen: gewünschte Labels auf Basis T-Nummer
     # Alle Temps beider Geräte in ein gemeinsames Feld (bei Dubletten gewinnt Gerät1).
     merged: Dict[str, float] = {}
     for dev in devices:
-        for t_key, val in dev.get("temps", {}).items():
-            try:
-                t_num = int(t_key[1:])  # "T7" -> 7
-            except Exception:
-                continue
-            if t_num in SENSOR_LABELS and not (SENSOR_LABELS[t_num] in merged):
-                merged[SENSOR_LABELS[t_num]] = val
+        temps, mask = dev["temps"], dev["temp_mask"]
+        for i, label in _LABEL_PAIRS:
+            # setdefault lässt bereits gesetzte Werte (Gerät1 bzw. kleinerer Index) stehen
+            if (mask >> i) & 1:
+                merged.setdefault(label, temps[i])
 
     # Zusätzlich (optional) alle übrigen T-Kanäle sichtbar machen:
     # for dev in devices:
-    #     for t_key, val in dev.get("temps", {}).items():
-    #         name = t_key
-    #         if name not in merged:
+    #     for i, val in enumerate(dev["temps"]):
+    #         name = f"T{i+1}"
+    #         if (dev["temp_mask"] >> i) & 1 and name not in merged:
     #             merged[name] = val
 
     return {
-        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "ok": True,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()),
         "port": SERIAL_PORT,
         "devices_found": len(devices),
         "values": merged,  # { "Warmwasser": 52.3, ... }
     }
 
+# Hintergrund-Abfrage: ein Daemon-Thread liest den D-LOGG alle POLL_INTERVAL Sekunden
+# (der D-LOGG aktualisiert ohnehin nur alle paar s); /api/current liefert nur den letzten Stand.
+# Nur ein Prozess darf den Port abfragen: mehrere Worker-Prozesse (z.B. gunicorn -w 4)
+# starten je einen eigenen Abfrage-Thread und blockieren sich gegenseitig am TTY.
+POLL_INTERVAL = 1.0
+_LATEST: Dict = {"data": None, "error": None}
+_LATEST_LOCK = threading.Lock()
+_FIRST_POLL = threading.Event()
+_POLLER: Optional[threading.Thread] = None
+_POLLER_LOCK = threading.Lock()
+
+def _store_latest(data: Optional[Dict], error: Optional[str]) -> None:
+    with _LATEST_LOCK:
+        _LATEST["data"] = data
+        _LATEST["error"] = error
+    _FIRST_POLL.set()
+
+def _poll_once() -> None:
+    try:
+        _store_latest(read_all_devices(), None)
+    except Exception as e:
+        # Fehler statt veralteter Werte melden, bis der nächste Abruf klappt
+        _store_latest(None, str(e))
+
+def _poller_loop() -> None:
+    while True:
+        _poll_once()
+        time.sleep(POLL_INTERVAL)
+
+def start_poller() -> None:
+    """Startet den Abfrage-Thread (einmalig; weitere Aufrufe sind wirkungslos)."""
+    global _POLLER
+    with _POLLER_LOCK:
+        if _POLLER is None:
+            _POLLER = threading.Thread(target=_poller_loop, name="dlogg-poller", daemon=True)
+            _POLLER.start()
+
+def read_latest(fresh: bool = False, wait: float = 5.0) -> Dict:
+    """
+    Letzter Stand des Abfrage-Threads (wartet beim Start bis zu wait Sekunden auf den ersten Abruf).
+    fresh=True liest direkt vom Port und aktualisiert den Stand (z.B. zum Debuggen).
+    Ist der letzte Abruf fehlgeschlagen, wird dessen Fehlermeldung als RuntimeError geworfen.
+    """
+    if fresh:
+        data = read_all_devices()
+        _store_latest(data, None)
+        return data
+    start_poller()
+    if not _FIRST_POLL.wait(wait):
+        raise RuntimeError("Noch keine Daten vom D-LOGG.")
+    with _LATEST_LOCK:
+        data, error = _LATEST["data"], _LATEST["error"]
+    if error is not None:
+        raise RuntimeError(error)
+    return data
+
+def _json_response(data: Dict) -> Response:
+    """JSON-Antwort über orjson (falls installiert), sonst Flasks jsonify."""
+    if orjson is None:
+        return jsonify(data)
+    return Response(orjson.dumps(data), mimetype="application/json")
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -236,8 +416,11 @@ def index():
 @app.route("/api/current")
 def api_current():
     try:
-        data = read_all_devices()
-        return jsonify({"ok": True, **data})
+        fresh = request.args.get("fresh") == "1"
+        resp = _json_response(read_latest(fresh=fresh))
+        # Browser/Proxies dürfen so lange zwischenspeichern wie ein Abfrage-Intervall
+        resp.headers["Cache-Control"] = "no-store" if fresh else f"max-age={max(1, round(POLL_INTERVAL))}"
+        return resp
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
@@ -247,10 +430,25 @@ def parse_args():
                    help="Serieller Port (Windows: COM4, Linux: /dev/ttyUSB0)")
     p.add_argument("--host", default="0.0.0.0")
     p.add_argument("--bind", type=int, default=5000, help="HTTP Port")
+    p.add_argument("--threads", type=int, default=4, help="HTTP-Worker-Threads (waitress)")
     return p.parse_args()
 
 if __name__ == "__main__":
     args = parse_args()
     SERIAL_PORT = args.port
+    try:
+        _import_serial()
+    except RuntimeError as e:
+        # ohne pySerial gleich beim Start abbrechen statt bei jeder Abfrage
+        print(e, file=sys.stderr)
+        sys.exit(1)
     print(f"* Starte Dashboard auf http://{args.host}:{args.bind}  (Port: {SERIAL_PORT})")
-    app.run(host=args.host, port=args.bind, debug=False)
+    start_poller()
+    try:
+        from waitress import serve
+    except ImportError:
+        print("waitress fehlt, nutze Flask-Entwicklungsserver. Installiere mit:  pip install waitress",
+              file=sys.stderr)
+        app.run(host=args.host, port=args.bind, debug=False, threaded=True)
+    else:
+        serve(app, host=args.host, port=args.bind, threads=args.threads)
@@ -75,7 +75,9 @@ cd "$PROJECT_DIR"
 
 # 5. Python-Abhängigkeiten installieren
 print_status "Installiere Python-Pakete..."
-pip3 install flask pyserial
+pip3 install flask pyserial waitress
+# optional: schnellere JSON-Ausgabe; ohne passendes Wheel (z.B. armv6) nicht abbrechen
+pip3 install orjson || print_warning "orjson nicht installiert, nutze jsonify"
 
 # 6. User zu dialout-Gruppe hinzufügen
 print_status "Füge User '$CURRENT_USER' zur dialout-Gruppe hinzu..."
@@ -0,0 +1,96 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import app  # noqa: E402
+
+
+class FakeReader:
+    """Ersatz für read_all_devices: liefert bzw. wirft die Ergebnisse der Reihe nach."""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def _data(value):
+    return {"ok": True, "values": {"Warmwasser": value}}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # kein echter Abfrage-Thread: Abrufe werden per app._poll_once() ausgelöst
+    monkeypatch.setattr(app, "start_poller", lambda: None)
+    monkeypatch.setattr(app, "_LATEST", {"data": None, "error": None})
+    monkeypatch.setattr(app, "_FIRST_POLL", app.threading.Event())
+    return app.app.test_client()
+
+
+def test_returns_latest_snapshot(client, monkeypatch):
+    reader = FakeReader(_data(52.3))
+    monkeypatch.setattr(app, "read_all_devices", reader)
+    app._poll_once()
+
+    for _ in range(3):
+        resp = client.get("/api/current")
+        assert resp.status_code == 200
+        assert resp.get_json()["values"] == {"Warmwasser": 52.3}
+        assert resp.headers["Cache-Control"] == "max-age=1"
+    assert reader.calls == 1
+
+
+def test_error_snapshot_until_next_successful_poll(client, monkeypatch):
+    monkeypatch.setattr(app, "read_all_devices",
+                        FakeReader(_data(50.0), OSError("Port weg"), _data(51.0)))
+    app._poll_once()
+    app._poll_once()
+
+    resp = client.get("/api/current")
+    assert resp.status_code == 500
+    assert resp.get_json() == {"ok": False, "error": "Port weg"}
+    assert client.get("/api/current").status_code == 500
+
+    app._poll_once()
+    resp = client.get("/api/current")
+    assert resp.status_code == 200
+    assert resp.get_json()["values"] == {"Warmwasser": 51.0}
+
+
+def test_fresh_bypasses_snapshot(client, monkeypatch):
+    reader = FakeReader(_data(40.0), _data(41.0))
+    monkeypatch.setattr(app, "read_all_devices", reader)
+    app._poll_once()
+
+    resp = client.get("/api/current?fresh=1")
+    assert resp.status_code == 200
+    assert resp.get_json()["values"] == {"Warmwasser": 41.0}
+    assert resp.headers["Cache-Control"] == "no-store"
+    assert reader.calls == 2
+
+    # der direkte Abruf aktualisiert auch den Stand für normale Anfragen
+    assert client.get("/api/current").get_json()["values"] == {"Warmwasser": 41.0}
+
+
+@pytest.mark.parametrize("interval, max_age", [(0.1, 1), (1.0, 1), (2.6, 3)])
+def test_max_age_follows_poll_interval(client, monkeypatch, interval, max_age):
+    monkeypatch.setattr(app, "POLL_INTERVAL", interval)
+    monkeypatch.setattr(app, "read_all_devices", FakeReader(_data(45.0)))
+    app._poll_once()
+
+    resp = client.get("/api/current")
+    assert resp.headers["Cache-Control"] == f"max-age={max_age}"
+
+
+def test_no_data_before_first_poll(client):
+    with pytest.raises(RuntimeError):
+        app.read_latest(wait=0)
@@ -0,0 +1,50 @@
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import app  # noqa: E402
+
+
+def _reference_temp(low, high):
+    """Ursprüngliche (verzweigte) Temperatur-Decodierung; None = kein Temperatur-Eingang."""
+    etype = (high >> 4) & 0b111
+    raw12 = ((high & 0x0F) << 8) | low
+    if etype == 0b010:
+        val = -(((~raw12) & 0x0FFF) + 1) if high & 0x80 else raw12
+        return val / 10.0
+    if etype == 0b111:
+        return (256 + low) / 10.0 if high & 0x01 else low / 10.0
+    return None
+
+
+def _all_pairs():
+    return [(low, high) for high in range(256) for low in range(256)]
+
+
+def test_decode_temps_matches_reference_for_all_pairs():
+    pairs = _all_pairs()
+    # 16 (low, high)-Paare je Block, Rest des 55-Byte-Blocks bleibt 0
+    for start in range(0, len(pairs), 16):
+        chunk = pairs[start:start + 16]
+        block = bytes(b for pair in chunk for b in pair) + bytes(55 - 32)
+        temps, mask = app._decode_temps(block)
+        for i, (low, high) in enumerate(chunk):
+            expected = _reference_temp(low, high)
+            if expected is None:
+                assert not (mask >> i) & 1, (low, high)
+                assert math.isnan(temps[i]), (low, high)
+            else:
+                assert (mask >> i) & 1, (low, high)
+                assert temps[i] == expected, (low, high)
+
+
+def test_decode_sensor_value_temps_match_reference_for_all_pairs():
+    for low, high in _all_pairs():
+        kind, val = app._decode_sensor_value(low, high)
+        expected = _reference_temp(low, high)
+        if expected is None:
+            assert kind != "temp", (low, high)
+        else:
+            assert (kind, val) == ("temp", expected), (low, high)
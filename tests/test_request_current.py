@@ -0,0 +1,59 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import app  # noqa: E402
+
+
+class FakeSerial:
+    """Minimaler Ersatz für serial.Serial: read(n) liefert höchstens die vorhandenen Bytes."""
+
+    def __init__(self, reply: bytes):
+        self._reply = reply
+        self.written = b""
+
+    def reset_input_buffer(self):
+        pass
+
+    def write(self, data: bytes):
+        self.written += data
+
+    def read(self, n: int) -> bytes:
+        chunk, self._reply = self._reply[:n], self._reply[n:]
+        return chunk
+
+
+def _frame(length: int) -> bytes:
+    return bytes(range(length))
+
+
+def test_1dl_frame():
+    ser = FakeSerial(_frame(57))
+    assert app.request_current(ser, app.MODE_1DL) == _frame(57)
+    assert ser.written == bytes([app.CMD_CURRENT])
+
+
+def test_1dl_mode_does_not_read_second_block():
+    ser = FakeSerial(_frame(113))
+    assert app.request_current(ser, app.MODE_1DL) == _frame(57)
+
+
+def test_full_2dl_frame():
+    ser = FakeSerial(_frame(113))
+    assert app.request_current(ser, app.MODE_2DL) == _frame(113)
+
+
+@pytest.mark.parametrize("length", [57, 58, 100, 112])
+def test_truncated_2dl_falls_back_to_first_block(length):
+    ser = FakeSerial(_frame(length))
+    assert app.request_current(ser, app.MODE_2DL) == _frame(57)
+
+
+@pytest.mark.parametrize("mode", [app.MODE_1DL, app.MODE_2DL])
+def test_short_first_block_raises(mode):
+    ser = FakeSerial(_frame(56))
+    with pytest.raises(RuntimeError):
+        app.request_current(ser, mode)